@@ -6,7 +6,7 @@ class SubmissionType(Enum):
     COMMENT = 'COMMENT'
     REPLY = 'REPLY'
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class SubmissionData:
     """Data class to store parsed Reddit submission information."""
     post_id: str  # Parent post ID (same as submission_id for posts)
@@ -0,0 +1,30 @@
+-- Initial schema for the stocks table. Idempotent: safe to re-run.
+
+-- Create enum type if it doesn't exist
+DO $$ BEGIN
+    CREATE TYPE submission_type AS ENUM ('POST', 'COMMENT', 'REPLY');
+EXCEPTION
+    WHEN duplicate_object THEN null;
+END $$;
+
+-- Create table if it doesn't exist
+CREATE TABLE IF NOT EXISTS stocks (
+    id SERIAL PRIMARY KEY,
+    post_id VARCHAR(30),
+    submission_id VARCHAR(30),
+    ticker CHAR(5),
+    author VARCHAR(30), 
+    subreddit VARCHAR(30),
+    score SMALLINT,
+    "type" submission_type,
+    created_utc TIMESTAMPTZ
+);
+
+-- One row per (submission, ticker): drop duplicates left by earlier runs, then enforce it
+DO $$ BEGIN
+    IF to_regclass('stocks_submission_ticker_idx') IS NULL THEN
+        DELETE FROM stocks a USING stocks b
+        WHERE a.id < b.id AND a.submission_id = b.submission_id AND a.ticker = b.ticker;
+        CREATE UNIQUE INDEX stocks_submission_ticker_idx ON stocks (submission_id, ticker);
+    END IF;
+END $$;
@@ -1,19 +1,34 @@
 import argparse
 import asyncio
+import logging
 import time
 import aiohttp
 import json
+from yarl import URL
 from datetime import datetime
-from typing import List, Tuple
+from typing import List, Set, Tuple
 from utils import (
+    get_session,
+    close_session,
     make_api_call,
     parse_json_for_post_ids,
     parse_json_for_post_content,
     parse_json_for_comment_content,
-    parse_json_for_reply_content,
+    parse_comment_or_reply,
 )
-from validator import SECTickerValidator
+from validator import SECTickerValidator, get_validator
 from stocks_db import StocksDB
+from custom_types import SubmissionType
+
+# libuv-backed event loop: less per-callback overhead with many requests in flight.
+# uvloop has no Windows build, so fall back to asyncio's default loop there.
+try:
+    import uvloop
+    EVENT_LOOP_FACTORY = uvloop.new_event_loop
+except ImportError:
+    EVENT_LOOP_FACTORY = None
+
+logger = logging.getLogger(__name__)
 
 # --- CONCURRENCY PARAMETERS ---
 
@@ -67,7 +82,7 @@ class RedditStockTracker:
             session: Shared aiohttp session
             validator: Ticker validator instance
             db: Database connection instance
-            semaphore: Concurrency control semaphore
+            semaphore: Caps concurrent Reddit requests; held only while a request is in flight
             num_top_posts: Number of top posts to fetch
             num_comments_per_post: Number of comments to fetch per post
             num_replies_per_comment: Number of replies to fetch per comment
@@ -80,6 +95,14 @@ class RedditStockTracker:
         self.num_top_posts = num_top_posts
         self.num_comments_per_post = num_comments_per_post
         self.num_replies_per_comment = num_replies_per_comment
+        
+        # Build the parsed base URL and fixed query strings once; per-call URLs only append path segments
+        self.base_url = URL(f"https://www.reddit.com/r/{subreddit}")
+        self.comments_url = self.base_url / "comments"
+        # depth trims the nested reply trees Reddit would otherwise send and we'd have to decode:
+        # a post fetch only needs top-level comment IDs, a comment fetch only its direct replies
+        self.post_query = {"sort": "top", "limit": num_comments_per_post + 2, "depth": 1}
+        self.comment_query = {"sort": "top", "limit": num_replies_per_comment + 2, "depth": 2}
     
     async def fetch_comment_data(self, comment_id: str, post_id: str) -> List:
         """Step 3a: Fetches the comment and its nested replies (1 API CALL), then parses and processes the comment.
@@ -92,37 +115,44 @@ class RedditStockTracker:
             List of reply objects to process
         """
         # --- Part 1: API Call (I/O-Bound) ---
-        async with self.semaphore:
-            comment_url = f"https://www.reddit.com/r/{self.subreddit}/comments/{post_id}/comment/{comment_id}.json?sort=top&limit={self.num_replies_per_comment + 2}"
-            raw_thread_json = await make_api_call(comment_url, self.session)
-            if not raw_thread_json:
-                print(f"    ❌ Failed to fetch comment {comment_id}")
-                return []
+        comment_url = (self.comments_url / post_id / "comment" / f"{comment_id}.json").with_query(self.comment_query)
+        raw_thread_json = await make_api_call(comment_url, self.session, semaphore=self.semaphore)
+        if not raw_thread_json:
+            # make_api_call already logged why (a warning, or debug for a deleted comment)
+            logger.debug("Failed to fetch comment %s", comment_id)
+            return []
         
         # --- Part 2: Parse comment and extract replies ---
-        comment_submission_data, comment_text, reply_objects = await parse_json_for_comment_content(raw_thread_json, post_id)
+        comment_submission_data, comment_text, reply_objects = parse_json_for_comment_content(raw_thread_json, post_id)
+        del raw_thread_json
         
         if comment_submission_data and comment_text:
             # --- Part 3: Extract tickers and insert into DB ---
-            tickers = self.validator.validate(comment_text)
+            tickers = await self.validator.validate_async(comment_text)
             if tickers:
                 self.db.insert(tickers, comment_submission_data)
         
-        return [(reply, post_id) for reply in reply_objects]  # Return tuples with post_id
+        return reply_objects
     
-    async def fetch_reply_data(self, reply: dict, post_id: str) -> None:
-        """Step 3b: Processes a single reply object.
+    async def process_replies(self, replies: List[Tuple[dict, str]]) -> None:
+        """Step 3b: Parses all reply objects and validates their text in one batched call.
         
         Args:
-            reply: Reply object extracted from the API response
-            post_id: ID of the parent post
+            replies: (reply object, parent post ID) pairs extracted from the comment responses
         """
-        # --- Parse the individual reply ---
-        reply_submission_data, reply_text = await parse_json_for_reply_content(reply, post_id)
+        # --- Parse the individual replies ---
+        parsed = []
+        for reply, post_id in replies:
+            reply_submission_data, reply_text, _ = parse_comment_or_reply(reply, post_id, SubmissionType.REPLY)
+            if reply_submission_data and reply_text:
+                parsed.append((reply_submission_data, reply_text))
         
-        if reply_submission_data and reply_text:
-            # --- Extract tickers and insert into DB ---
-            tickers = self.validator.validate(reply_text)
+        if not parsed:
+            return
+        
+        # --- Extract tickers for every reply at once and insert into DB ---
+        results = await self.validator.validate_many_async([text for _, text in parsed])
+        for (reply_submission_data, _), tickers in zip(parsed, results):
             if tickers:
                 self.db.insert(tickers, reply_submission_data)
     
@@ -136,24 +166,49 @@ class RedditStockTracker:
             List of comment IDs
         """
         # --- Part 1: API Call (I/O-Bound) ---
-        async with self.semaphore:
-            post_url = f"https://www.reddit.com/r/{self.subreddit}/comments/{post_id}.json?sort=top&limit={self.num_comments_per_post + 2}"
-            raw_post_json = await make_api_call(post_url, self.session)
-            if not raw_post_json:
-                print(f"  ❌ Failed to fetch post {post_id}")
-                return []
+        post_url = (self.comments_url / f"{post_id}.json").with_query(self.post_query)
+        raw_post_json = await make_api_call(post_url, self.session, semaphore=self.semaphore)
+        if not raw_post_json:
+            logger.debug("Failed to fetch post %s", post_id)
+            return []
 
         # --- Part 2: JSON Parsing ---
-        submission_data, post_text, comment_ids = await parse_json_for_post_content(raw_post_json)
+        submission_data, post_text, comment_ids = parse_json_for_post_content(raw_post_json, self.num_comments_per_post)
+        # Release the decoded thread before waiting on the validator; only the parsed fields are kept
+        del raw_post_json
 
         if submission_data and post_text:
             # --- Part 3: Extract tickers and insert into DB ---
-            tickers = self.validator.validate(post_text)
+            tickers = await self.validator.validate_async(post_text)
             if tickers:
                 self.db.insert(tickers, submission_data)
         
         return comment_ids
     
+    async def process_post(
+        self,
+        post_id: str,
+        task_group: asyncio.TaskGroup,
+        seen_comment_ids: Set[str],
+        comment_tasks: List[Tuple[str, asyncio.Task]]
+    ) -> None:
+        """Step 2 + 3a: Fetches a post, then immediately schedules fetches for its comments.
+        
+        Args:
+            post_id: ID of the post to fetch
+            task_group: Task group the comment fetches are scheduled on
+            seen_comment_ids: Comment IDs already scheduled, shared across posts
+            comment_tasks: Collects (post_id, task) pairs for the scheduled comment fetches
+        """
+        comment_ids = await self.fetch_post_data_and_comment_ids(post_id)
+        
+        # Skip comment IDs already scheduled so each comment costs at most one API call
+        for comment_id in comment_ids:
+            if comment_id in seen_comment_ids:
+                continue
+            seen_comment_ids.add(comment_id)
+            comment_tasks.append((post_id, task_group.create_task(self.fetch_comment_data(comment_id, post_id))))
+    
     async def process(self) -> None:
         """Process the subreddit - fetch posts, comments, and replies."""
         
@@ -163,45 +218,48 @@ class RedditStockTracker:
 
         # --- Block 1: Sequential Fetch and Parse (1 API Call) ---
         print("\n[BLOCK 1] Fetching and Parsing top post IDs...")
-        listing_url = f"https://www.reddit.com/r/{self.subreddit}/top.json?limit={self.num_top_posts}&t=week"
-        raw_listing_json = await make_api_call(listing_url, self.session)
+        listing_url = (self.base_url / "top.json").with_query(limit=self.num_top_posts, t="week")
+        raw_listing_json = await make_api_call(listing_url, self.session, semaphore=self.semaphore)
         
         if not raw_listing_json:
-            print("❌ Failed to fetch post listing")
+            logger.error("❌ Failed to fetch post listing for r/%s", self.subreddit)
             return
             
-        post_ids = await parse_json_for_post_ids(raw_listing_json)
+        post_ids = parse_json_for_post_ids(raw_listing_json)
         print(f"Total Post IDs to process: {len(post_ids)}")
 
-        # --- Block 2: Concurrent Post Fetch ---
-        post_tasks = [self.fetch_post_data_and_comment_ids(post_id) for post_id in post_ids]
-            
-        print(f"\n[BLOCK 2] Launching {len(post_tasks)} concurrent Post Fetches ({self.num_top_posts} API calls)...")
-        post_results = await asyncio.gather(*post_tasks)
+        # --- Blocks 2 & 3: Concurrent Post Fetch, chaining Comment Fetches as each post completes ---
+        print(f"\n[BLOCK 2] Launching {len(post_ids)} concurrent Post Fetches ({len(post_ids)} API calls)...")
+        print("[BLOCK 3] Comment Fetches start as soon as their parent post is parsed...")
+        comment_tasks = []
+        seen_comment_ids = set()
+        async with asyncio.TaskGroup() as task_group:
+            for post_id in post_ids:
+                task_group.create_task(
+                    self.process_post(post_id, task_group, seen_comment_ids, comment_tasks)
+                )
         
-        # Consolidate results and prepare for the next block
-        comment_fetch_tasks = []
-        for i, comment_ids in enumerate(post_results):
-            parent_post_id = post_ids[i]
-            for comment_id in comment_ids:
-                task = self.fetch_comment_data(comment_id, parent_post_id)
-                comment_fetch_tasks.append(task)
-                
-        # --- Block 3: Highly Concurrent Comment/Reply Fetch ---
-        print(f"\n[BLOCK 3] Launching {len(comment_fetch_tasks)} concurrent Comment Fetches...")
-        comment_results = await asyncio.gather(*comment_fetch_tasks)
-        
-        # Process comment results and prepare individual reply tasks
-        reply_tasks = []
-        for replies_list in comment_results:
-            for reply, post_id in replies_list:  # Unpack tuple with post_id
-                task = self.fetch_reply_data(reply, post_id)
-                reply_tasks.append(task)
+        print(f"\n[BLOCK 3] Completed {len(comment_tasks)} concurrent Comment Fetches")
+
+        # Flatten comment results into the replies to process, dropping replies seen twice
+        replies = []
+        seen_reply_ids = set()
+        for post_id, task in comment_tasks:
+            for reply in task.result():
+                reply_id = reply["data"]["id"]
+                if reply_id in seen_reply_ids:
+                    continue
+                seen_reply_ids.add(reply_id)
+                replies.append((reply, post_id))
         
-        # Execute all reply processing tasks concurrently
-        if reply_tasks:
-            print(f"\n[BLOCK 3 Continued] Processing {len(reply_tasks)} replies...")
-            await asyncio.gather(*reply_tasks)
+        # Replies need no API call, so they are validated together in one batched inference
+        # call rather than one task per reply
+        if replies:
+            print(f"\n[BLOCK 3 Continued] Processing {len(replies)} replies...")
+            await self.process_replies(replies)
+
+        # Commit every row queued during this run in one transaction
+        await self.db.flush()
 
         print(f"✅ Completed processing r/{self.subreddit}")
 
@@ -210,7 +268,8 @@ async def main(
     max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS,
     num_top_posts: int = NUM_TOP_POSTS,
     num_comments_per_post: int = NUM_COMMENTS_PER_POST,
-    num_replies_per_comment: int = NUM_REPLIES_PER_COMMENT
+    num_replies_per_comment: int = NUM_REPLIES_PER_COMMENT,
+    refresh_tickers: bool = False
 ):
     """Main entry point - processes a single subreddit.
     
@@ -220,6 +279,7 @@ async def main(
         num_top_posts: Number of top posts to fetch
         num_comments_per_post: Number of comments to fetch per post
         num_replies_per_comment: Number of replies to fetch per comment
+        refresh_tickers: Re-download the full SEC ticker list instead of revalidating the cache
     """
     
     print(f"--- Starting Reddit Stock Tracker Workflow ---")
@@ -230,15 +290,19 @@ async def main(
     print(f"Replies per comment: {num_replies_per_comment}")
     print("-" * 60)
 
-    # Initialize database and validator
-    db = StocksDB()
-    validator = SECTickerValidator()
-    await validator.load_tickers()
-    print("✅ Database connection and validator initialized\n")
+    # Shared keep-alive session for Reddit and SEC; it stays open across main() calls
+    # and is closed by the caller
+    session = get_session(max_concurrent_requests)
 
-    semaphore = asyncio.Semaphore(max_concurrent_requests)
-
-    async with aiohttp.ClientSession() as session:
+    # Initialize database and validator
+    db = await StocksDB.create()
+    # Buffered rows are only written by flush(), so close (which flushes) even if the run fails
+    try:
+        validator = await get_validator(session, refresh_tickers)
+        print("✅ Database connection and validator initialized\n")
+        
+        semaphore = asyncio.Semaphore(max_concurrent_requests)
+        
         # Create tracker and process the subreddit
         tracker = RedditStockTracker(
             subreddit=subreddit,
@@ -251,9 +315,9 @@ async def main(
             num_replies_per_comment=num_replies_per_comment
         )
         await tracker.process()
-    
-    # Close database connection
-    db.close()
+    finally:
+        # Close database connection
+        await db.close()
     
     # Save last run date
     save_last_run_date(subreddit)
@@ -299,20 +363,35 @@ def setup_argument_parser() -> argparse.ArgumentParser:
         default=NUM_REPLIES_PER_COMMENT,
         help=f"Number of replies to fetch per comment (default: {NUM_REPLIES_PER_COMMENT})"
     )
+    parser.add_argument(
+        "--refresh-tickers",
+        action="store_true",
+        help="Re-download the full SEC ticker list instead of revalidating the local cache"
+    )
     return parser
 
 if __name__ == "__main__":
     parser = setup_argument_parser()
     args = parser.parse_args()
     
+    # Show fetch warnings and retry notices; per-parse and per-skip lines stay at debug
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    
+    async def run():
+        try:
+            await main(
+                args.subreddit,
+                args.max_concurrent_requests,
+                args.num_top_posts,
+                args.num_comments_per_post,
+                args.num_replies_per_comment,
+                args.refresh_tickers
+            )
+        finally:
+            await close_session()
+    
     start_time = time.time()
-    asyncio.run(main(
-        args.subreddit,
-        args.max_concurrent_requests,
-        args.num_top_posts,
-        args.num_comments_per_post,
-        args.num_replies_per_comment
-    )) 
+    asyncio.run(run(), loop_factory=EVENT_LOOP_FACTORY)
     end_time = time.time()
     
     print(f"\nTotal execution time: {end_time - start_time:.2f} seconds")
@@ -1,74 +1,135 @@
+import asyncio
 import psycopg
 import os
 from dotenv import load_dotenv
 from typing import List
-from datetime import datetime, timezone
 from custom_types import SubmissionData
 
 load_dotenv()
 
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+INSERT_QUERY = """
+    INSERT INTO stocks (post_id, submission_id, ticker, author, subreddit, score, "type", created_utc)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, to_timestamp(%s::double precision))
+    ON CONFLICT (submission_id, ticker) DO UPDATE
+    SET score = EXCLUDED.score, created_utc = EXCLUDED.created_utc
+"""
+
+# Batches at least this large are streamed with COPY instead of executemany
+BULK_INSERT_THRESHOLD = 500
+
+# COPY can't upsert, so bulk rows are streamed into a session-local staging table and then
+# merged into stocks with the same ON CONFLICT rule as INSERT_QUERY
+CREATE_STAGING_QUERY = """
+    CREATE TEMP TABLE IF NOT EXISTS stocks_staging (
+        post_id TEXT,
+        submission_id TEXT,
+        ticker TEXT,
+        author TEXT,
+        subreddit TEXT,
+        score INTEGER,
+        "type" TEXT,
+        created_utc DOUBLE PRECISION
+    ) ON COMMIT DELETE ROWS
+"""
+
+COPY_STAGING_QUERY = """
+    COPY stocks_staging (post_id, submission_id, ticker, author, subreddit, score, "type", created_utc)
+    FROM STDIN (FORMAT BINARY)
+"""
+
+# Column types of stocks_staging, in COPY order, so psycopg can dump rows in binary directly
+STAGING_COLUMN_TYPES = ["text", "text", "text", "text", "text", "int4", "text", "float8"]
+
+MERGE_STAGING_QUERY = """
+    INSERT INTO stocks (post_id, submission_id, ticker, author, subreddit, score, "type", created_utc)
+    SELECT DISTINCT ON (submission_id, ticker)
+        post_id, submission_id, ticker, author, subreddit, score, "type"::submission_type, to_timestamp(created_utc)
+    FROM stocks_staging
+    ON CONFLICT (submission_id, ticker) DO UPDATE
+    SET score = EXCLUDED.score, created_utc = EXCLUDED.created_utc
+"""
+
 class StocksDB:
-    def __init__(self):
-        self.conn = psycopg.connect(os.getenv('DB_URL'))
+    def __init__(self, conn: psycopg.AsyncConnection):
+        """Wrap an open async connection. Use StocksDB.create() to connect."""
+        self.conn = conn
         self.cur = self.conn.cursor()
         
-        # Create enum type if it doesn't exist
-        self.cur.execute("""
-            DO $$ BEGIN
-                CREATE TYPE submission_type AS ENUM ('POST', 'COMMENT', 'REPLY');
-            EXCEPTION
-                WHEN duplicate_object THEN null;
-            END $$;
-        """)
-        
-        # Create table if it doesn't exist
-        self.cur.execute("""
-            CREATE TABLE IF NOT EXISTS stocks (
-                id SERIAL PRIMARY KEY,
-                post_id VARCHAR(30),
-                submission_id VARCHAR(30),
-                ticker CHAR(5),
-                author VARCHAR(30), 
-                subreddit VARCHAR(30),
-                score SMALLINT,
-                "type" submission_type,
-                created_utc TIMESTAMPTZ
-            )
-        """)
+        # Rows queued by insert() and written in one batch by flush()
+        self.buffer: List[tuple] = []
+
+    @classmethod
+    async def create(cls) -> "StocksDB":
+        """Open an async connection. The schema must already exist (see bootstrap())."""
+        conn = await psycopg.AsyncConnection.connect(os.getenv('DB_URL'))
+        db = cls(conn)
         
-        self.conn.commit()
+        # Prepare statements on first use so the INSERT is parsed/planned once per connection.
+        db.conn.prepare_threshold = 0
         print("✅ Connected to remote database")
+        return db
+
+    @classmethod
+    async def bootstrap(cls):
+        """Apply the SQL files in migrations/ in order. Run once per database; safe to re-run."""
+        async with await psycopg.AsyncConnection.connect(os.getenv('DB_URL')) as conn:
+            for name in sorted(os.listdir(MIGRATIONS_DIR)):
+                if not name.endswith('.sql'):
+                    continue
+                with open(os.path.join(MIGRATIONS_DIR, name)) as f:
+                    await conn.execute(f.read(), prepare=False)
+                print(f"✅ Applied migration {name}")
 
     def insert(self, tickers: List[str], submission: SubmissionData):
-        """Insert each ticker with the submission data into the database."""
-        # Convert Unix timestamp to datetime
-        created_dt = datetime.fromtimestamp(submission.created_utc, tz=timezone.utc)
+        """Buffer each ticker with the submission data; rows are written on flush()."""
+        # Read the per-submission columns once; only the ticker varies between rows.
+        # created_utc stays a Unix epoch; Postgres converts it with to_timestamp()
+        post_id = submission.post_id
+        submission_id = submission.submission_id
+        tail = (
+            submission.author,
+            submission.subreddit,
+            submission.score,
+            submission.type.value,
+            submission.created_utc
+        )
         
-        # Insert each ticker as a separate row
-        for ticker in tickers:
-            insert_query = """
-                INSERT INTO stocks (post_id, submission_id, ticker, author, subreddit, score, "type", created_utc)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """
-            insert_data = (
-                submission.post_id,
-                submission.submission_id,
-                ticker,
-                submission.author,
-                submission.subreddit,
-                submission.score,
-                submission.type.value,
-                created_dt
-            )
-            
-            self.cur.execute(insert_query, insert_data)
-        
-        self.conn.commit()
-        print(f'✅ Inserted {len(tickers)} ticker(s) into database')
-
-    def close(self):
-        """Close cursor and connection."""
-        self.cur.close()
-        self.conn.close()
-        print("✅ Closed database connection")
-    
\ No newline at end of file
+        # One row per ticker
+        self.buffer.extend((post_id, submission_id, ticker, *tail) for ticker in tickers)
+
+    async def bulk_insert(self, rows: List[tuple]):
+        """Stream rows to the server with binary COPY, then upsert them into stocks in one statement."""
+        await self.cur.execute(CREATE_STAGING_QUERY, prepare=False)
+        async with self.cur.copy(COPY_STAGING_QUERY) as copy:
+            copy.set_types(STAGING_COLUMN_TYPES)
+            for row in rows:
+                await copy.write_row(row)
+        await self.cur.execute(MERGE_STAGING_QUERY)
+
+    async def flush(self):
+        """Write all buffered rows in a single transaction: COPY for large batches, else executemany."""
+        if not self.buffer:
+            return
+        if len(self.buffer) >= BULK_INSERT_THRESHOLD:
+            await self.bulk_insert(self.buffer)
+        else:
+            await self.cur.executemany(INSERT_QUERY, self.buffer)
+        await self.conn.commit()
+        print(f'✅ Inserted {len(self.buffer)} ticker(s) into database')
+        self.buffer.clear()
+
+    async def close(self):
+        """Flush pending rows, then close cursor and connection (even if the flush fails)."""
+        try:
+            await self.flush()
+        finally:
+            await self.cur.close()
+            await self.conn.close()
+            print("✅ Closed database connection")
+    
+
+
+if __name__ == "__main__":
+    asyncio.run(StocksDB.bootstrap())
@@ -1,28 +1,37 @@
 import asyncio
+import logging
 from utils import (
+    get_session,
+    close_session,
     make_api_call,
     parse_json_for_post_ids,
     parse_json_for_post_content,
     parse_json_for_comment_content,
-    parse_json_for_reply_content
+    parse_comment_or_reply
 )
 from stocks_db import StocksDB
+from custom_types import SubmissionType
 from validator import SECTickerValidator
-import aiohttp
+from reddit_stocks import MAX_CONCURRENT_REQUESTS
 
 
 async def main():
-    """Test function for make_api_call, parse_json_for_post_ids, parse_json_for_post_content, and parse_json_for_comment_content"""
+    """Test function for make_api_call, the parse_json_for_* parsers, batched ticker validation and DB insertion"""
     print("🧪 Testing parsing functions and database insertion...\n")
     
     # Initialize database connection and validator
-    db = StocksDB()
+    db = await StocksDB.create()
     validator = SECTickerValidator()
-    await validator.load_tickers()
-    print("✅ Database connection and validator initialized\n")
     
-    # Create a session for the test
-    async with aiohttp.ClientSession() as session:
+    # (type, submission data, text) collected from the post, comment and reply for one batched validation
+    to_validate = []
+    
+    # Use the scraper's shared session so the test runs with the production connection settings
+    session = get_session(MAX_CONCURRENT_REQUESTS)
+    try:
+        await validator.load_tickers(session)
+        print("✅ Database connection and validator initialized\n")
+        
         # Test 1: Fetch JSON from Reddit
         print("Test 1: Fetching JSON from Reddit")
         url = "https://www.reddit.com/r/ValueInvesting/top.json?limit=10&t=week"
@@ -32,7 +41,7 @@ async def main():
             
             # Test 2: Parse the JSON for post IDs
             print("Test 2: Parsing JSON for post IDs")
-            post_ids = await parse_json_for_post_ids(result)
+            post_ids = parse_json_for_post_ids(result)
             if post_ids:
                 print(f"✅ Successfully parsed {len(post_ids)} post IDs")
                 print(f"Post IDs: {post_ids}\n")
@@ -46,22 +55,15 @@ async def main():
                 
                 if post_data:
                     # post_data already contains both post and comments data in array format
-                    submission_data, post_text, comment_ids = await parse_json_for_post_content(post_data)
+                    submission_data, post_text, comment_ids = parse_json_for_post_content(post_data)
                     if submission_data:
                         print(f"✅ Successfully parsed post content")
                         print(f"   Author: {submission_data.author}")
                         print(f"   Score: {submission_data.score}")
                         print(f"   Comment IDs: {comment_ids}\n")
                         
-                        # Test 6: Extract tickers and insert post data into database
-                        print("Test 6: Extracting tickers from post text and inserting into DB")
-                        tickers = validator.validate(post_text)
-                        print(f"   Tickers found: {tickers}")
-                        if tickers:
-                            db.insert(tickers, submission_data)
-                        else:
-                            print("   ⚠️  No valid tickers found in post")
-                        print()
+                        # Queue the post text for the batched validation in Test 6
+                        to_validate.append(("post", submission_data, post_text))
                         
                         # Test 4: Fetch and parse content for the first comment
                         if comment_ids:
@@ -72,44 +74,30 @@ async def main():
                             comment_data = await make_api_call(comment_url, session)
                             
                             if comment_data:
-                                comment_submission_data, comment_text, reply_objects = await parse_json_for_comment_content(comment_data, first_post_id)
+                                comment_submission_data, comment_text, reply_objects = parse_json_for_comment_content(comment_data, first_post_id)
                                 if comment_submission_data:
                                     print(f"✅ Successfully parsed comment content")
                                     print(f"   Author: {comment_submission_data.author}")
                                     print(f"   Score: {comment_submission_data.score}")
                                     print(f"   Reply Objects: {len(reply_objects)} replies\n")
                                     
-                                    # Test 7: Extract tickers and insert comment data into database
-                                    print("Test 7: Extracting tickers from comment text and inserting into DB")
-                                    tickers = validator.validate(comment_text)
-                                    print(f"   Tickers found: {tickers}")
-                                    if tickers:
-                                        db.insert(tickers, comment_submission_data)
-                                    else:
-                                        print("   ⚠️  No valid tickers found in comment")
-                                    print()
+                                    # Queue the comment text for the batched validation in Test 6
+                                    to_validate.append(("comment", comment_submission_data, comment_text))
                                     
                                     # Test 5: Fetch and parse content for the first reply
                                     if reply_objects:
                                         print("Test 5: Parsing first reply content")
                                         first_reply = reply_objects[0]
                                         
-                                        reply_submission_data, reply_text = await parse_json_for_reply_content(first_reply, first_post_id)
+                                        reply_submission_data, reply_text, _ = parse_comment_or_reply(first_reply, first_post_id, SubmissionType.REPLY)
                                         if reply_submission_data:
                                             print(f"✅ Successfully parsed reply content")
                                             print(f"   Author: {reply_submission_data.author}")
                                             print(f"   Score: {reply_submission_data.score}")
                                             print(f"   Type: {reply_submission_data.type.name}\n")
                                             
-                                            # Test 8: Extract tickers and insert reply data into database
-                                            print("Test 8: Extracting tickers from reply text and inserting into DB")
-                                            tickers = validator.validate(reply_text)
-                                            print(f"   Tickers found: {tickers}")
-                                            if tickers:
-                                                db.insert(tickers, reply_submission_data)
-                                            else:
-                                                print("   ⚠️  No valid tickers found in reply")
-                                            print()
+                                            # Queue the reply text for the batched validation in Test 6
+                                            to_validate.append(("reply", reply_submission_data, reply_text))
                                         else:
                                             print("❌ Failed to parse reply content\n")
                                 else:
@@ -124,11 +112,27 @@ async def main():
                 print("❌ Failed to parse post IDs\n")
         else:
             print("❌ Failed to fetch data\n")
+    finally:
+        await close_session()
+    
+    # Test 6: Extract tickers from every collected text in one batched call and insert into DB
+    if to_validate:
+        print("Test 6: Extracting tickers from post, comment and reply text and inserting into DB")
+        results = validator.validate_many([text for _, _, text in to_validate])
+        for (kind, submission, _), tickers in zip(to_validate, results):
+            print(f"   Tickers found in {kind}: {tickers}")
+            if tickers:
+                db.insert(tickers, submission)
+            else:
+                print(f"   ⚠️  No valid tickers found in {kind}")
+        print()
     
     # Close database connection
-    db.close()
+    await db.close()
     print("✅ Database connection closed")
 
 
 if __name__ == "__main__":
+    # Keep utils' per-parse debug lines quiet
+    logging.basicConfig(level=logging.INFO)
     asyncio.run(main())
@@ -0,0 +1,84 @@
+import asyncio
+from unittest.mock import patch
+import validator
+from validator import SECTickerValidator
+
+# Seconds a caller may wait before the test counts it as hung
+CALLER_TIMEOUT = 5
+
+
+class StubGLiNER:
+    """Stands in for the GLiNER model: tags every upper-case word, and records each inference call."""
+
+    def __init__(self):
+        self.calls = []
+        self.fail = False
+
+    def inference(self, texts, labels, threshold=0.5, batch_size=8):
+        self.calls.append(list(texts))
+        if self.fail:
+            raise RuntimeError("stubbed inference failure")
+        return [[{"text": word} for word in text.split() if word.lstrip("$").isupper()] for text in texts]
+
+
+def make_validator() -> tuple[SECTickerValidator, StubGLiNER]:
+    """Build a validator on the stub model with a small fixed ticker set."""
+    stub = StubGLiNER()
+    with patch.object(validator.GLiNER, "from_pretrained", return_value=stub):
+        ticker_validator = SECTickerValidator()
+    ticker_validator.set_valid_tickers({"AAPL", "TSLA", "MSFT", "GME"})
+    return ticker_validator, stub
+
+
+async def validate_all(ticker_validator: SECTickerValidator, texts: list) -> list:
+    """Validate texts from concurrent callers, failing if any of them hangs."""
+    return await asyncio.wait_for(
+        asyncio.gather(*(ticker_validator.validate_async(text) for text in texts)),
+        CALLER_TIMEOUT
+    )
+
+
+async def main():
+    """Behavior checks for validate_async's batching, using a stubbed GLiNER model"""
+    print("🧪 Testing batched ticker validation...\n")
+
+    # Test 1: Concurrent callers share one inference call and each get their own result
+    print("Test 1: Fusing concurrent validate_async callers")
+    ticker_validator, stub = make_validator()
+    texts = ["buying $AAPL today", "Great post, thank you", "TSLA to the moon", "MSFT and GME"]
+    results = await validate_all(ticker_validator, texts)
+    assert results == [["AAPL"], [], ["TSLA"], ["GME", "MSFT"]], results
+    assert len(stub.calls) == 1, stub.calls
+    # Text with no ticker-shaped word never reaches the model
+    assert "Great post, thank you" not in stub.calls[0], stub.calls
+    print(f"✅ {len(texts)} callers, {len(stub.calls)} inference call, results mapped back per caller\n")
+
+    # Test 2: A cancelled caller doesn't keep the rest of its batch from resolving
+    print("Test 2: Cancelling one caller in a batch")
+    ticker_validator, stub = make_validator()
+    tasks = [asyncio.create_task(ticker_validator.validate_async(text)) for text in ("GME squeeze", "AAPL earnings")]
+    await asyncio.sleep(0)
+    tasks[0].cancel()
+    assert await asyncio.wait_for(tasks[1], CALLER_TIMEOUT) == ["AAPL"]
+    print("✅ Remaining caller resolved\n")
+
+    # Test 3: A detection failure resolves every caller instead of hanging them
+    print("Test 3: Inference failure")
+    ticker_validator, stub = make_validator()
+    stub.fail = True
+    results = await validate_all(ticker_validator, ["AAPL calls", "TSLA puts"])
+    assert results == [[], []], results
+    assert ticker_validator.drain_task is None
+
+    # Failures aren't cached, so the same text is retried once the model recovers
+    stub.fail = False
+    results = await validate_all(ticker_validator, ["AAPL calls"])
+    assert results == [["AAPL"]], results
+    assert len(stub.calls) == 2, stub.calls
+    print("✅ Callers resolved with no tickers, and the text was retried afterwards\n")
+
+    print("✅ All batching checks passed")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
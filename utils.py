@@ -1,76 +1,159 @@
 import asyncio
-import time
+import contextlib
 import aiohttp
+import logging
 import os
+import random
+import orjson
+from yarl import URL
 from typing import List, Tuple, Dict, Any
 from custom_types import SubmissionData, SubmissionType
 from dotenv import load_dotenv
 
 load_dotenv()
 
-MAX_RETRIES = 1
+# Per-parse progress lines are debug-level so they cost nothing unless logging is configured
+logger = logging.getLogger(__name__)
+
+# Rate-limit (429) and server-error (5xx) retries: exponential back-off with jitter
+# unless Reddit says how long to wait
+MAX_RETRIES = 4
+BACKOFF_BASE_SECONDS = 2
+MAX_BACKOFF_SECONDS = 600  # Reddit's rate-limit window is 10 minutes
+RATE_LIMIT_HEADERS = ("Retry-After", "X-Ratelimit-Reset")
+# Deleted, removed or private submissions: expected, so skipped without an exception
+UNAVAILABLE_STATUSES = (403, 404)
+
+# Reddit usually requires a unique User-Agent to avoid 429 (Too Many Requests).
+# Built once at import and set as the ClientSession's default headers.
+REDDIT_HEADERS = {"User-Agent": f"MyStockScraper/1.0 {os.getenv("EMAIL")} by u/Ok_Cucumber_3696"}
+
+# Bounds a single request so a stalled connection can't hang the run
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=60, connect=10)
+
+# Process-wide session, created lazily by get_session() and closed by close_session()
+_session: aiohttp.ClientSession | None = None
+_session_loop: asyncio.AbstractEventLoop | None = None
 
 # --- Fetch Data ---
 
-async def make_api_call(url: str, session: aiohttp.ClientSession, params: dict = None, retry_count: int = 0):
+def get_session(max_connections: int) -> aiohttp.ClientSession:
+    """
+    Return the process-wide session (Reddit and SEC), creating it on first use.
+    The connector pool is sized to max_connections and keeps connections and DNS lookups
+    alive, so repeated runs in the same event loop skip the TLS handshake and resolution.
+    A closed session, or one bound to a finished event loop, is replaced.
+    """
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit=max_connections,
+            limit_per_host=max_connections,
+            ttl_dns_cache=300,
+            keepalive_timeout=60
+        )
+        _session = aiohttp.ClientSession(headers=REDDIT_HEADERS, connector=connector, timeout=REQUEST_TIMEOUT)
+        _session_loop = loop
+    return _session
+
+async def close_session():
+    """Close the process-wide session, if one is open. Call once before the event loop ends."""
+    global _session, _session_loop
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = _session_loop = None
+
+
+def rate_limit_delay(headers: Dict[str, str], attempt: int) -> float:
+    """
+    Seconds to wait before retrying a 429: Reddit's Retry-After / X-Ratelimit-Reset if present,
+    otherwise exponential back-off. Jitter keeps concurrent callers from retrying in lockstep.
+    """
+    delay = BACKOFF_BASE_SECONDS * 2 ** attempt
+    for header in RATE_LIMIT_HEADERS:
+        try:
+            delay = float(headers[header])
+            break
+        except (KeyError, ValueError):
+            continue
+    return min(delay, MAX_BACKOFF_SECONDS) + random.uniform(0, 0.5)
+
+async def make_api_call(
+    url: str | URL,
+    session: aiohttp.ClientSession,
+    params: dict = None,
+    semaphore: asyncio.Semaphore | None = None
+):
     """
     Performs the actual GET request using the shared session.
+    The session must be created with headers=REDDIT_HEADERS.
+    Retries up to MAX_RETRIES times on a rate limit (429) or server error (5xx), in a loop
+    rather than recursively. Deleted, removed or private submissions (403/404) are expected
+    and return None without raising.
+    If a semaphore is given it is held only while a request is in flight, not during the
+    retry sleep, so a throttled call doesn't keep a concurrency slot idle.
     """
-    # Reddit usually requires a unique User-Agent to avoid 429 (Too Many Requests)
-    headers = {"User-Agent": f"MyStockScraper/1.0 {os.getenv("EMAIL")} by u/Ok_Cucumber_3696"}
-    
+    gate = semaphore if semaphore is not None else contextlib.nullcontext()
     try:
-        # The 'await' happens here - yielding control while waiting for Reddit
-        async with session.get(url, headers=headers, params=params) as response:
-            
-            # Check for Rate Limits (429) or Errors
-            if response.status == 429:
-                if retry_count >= MAX_RETRIES:
-                    print(f"⚠️ Rate limited on {url}. Max retries exceeded.")
+        for attempt in range(MAX_RETRIES + 1):
+            # The 'await' happens here - yielding control while waiting for Reddit
+            async with gate, session.get(url, params=params) as response:
+                status = response.status
+                if status < 400:
+                    # Decode the raw body with orjson (much faster than stdlib json, same dicts)
+                    return orjson.loads(await response.read())
+                
+                if status in UNAVAILABLE_STATUSES:
+                    logger.debug("Skipping unavailable %s (%d)", url, status)
                     return None
-                print(f"⚠️ Rate limited on {url}. Sleeping for 60s...")
-                await asyncio.sleep(60)
-                # Retry once with incremented counter
-                return await make_api_call(url, session, params, retry_count + 1)
-
-            response.raise_for_status() # Raise error for 404, 500, etc.
+                
+                if status != 429 and status < 500:
+                    response.raise_for_status() # Raise error for anything else unexpected
+                
+                delay = rate_limit_delay(response.headers, attempt)
             
-            # Return the JSON data directly
-            return await response.json()
+            # Rate limited or server error. The response is released before sleeping so its
+            # connection goes back to the pool instead of idling for the whole wait.
+            reason = "Rate limited" if status == 429 else f"Server error {status}"
+            if attempt == MAX_RETRIES:
+                logger.warning("⚠️ %s on %s. Max retries exceeded.", reason, url)
+                return None
+            logger.info("⚠️ %s on %s. Sleeping for %.1fs...", reason, url, delay)
+            await asyncio.sleep(delay)
             
-    except Exception as e:
-        print(f"❌ Error fetching {url}: {e}")
+    except (aiohttp.ClientError, asyncio.TimeoutError, orjson.JSONDecodeError) as e:
+        logger.warning("❌ Error fetching %s: %s", url, e)
         return None
 
-# --- JSON PARSING FUNCTIONS (ASYNC as they deal with network results, but mostly CPU-bound) ---
+# --- JSON PARSING FUNCTIONS (SYNC: pure CPU work on already-fetched JSON) ---
 
-async def parse_json_for_post_ids(raw_json: Dict[str, Any]) -> List[str]:
+def parse_json_for_post_ids(raw_json: Dict[str, Any]) -> List[str]:
     """Parses the JSON response from the top 10 list API call."""
     # Navigate through the Reddit JSON structure: data -> children -> data -> id
     post_ids = []
     
+    # Reddit always sends these keys, so index directly; a malformed listing falls to the except
     try:
-        children = raw_json.get("data", {}).get("children", [])
-        for child in children:
-            post_id = child.get("data", {}).get("id")
-            if post_id:
-                post_ids.append(post_id)
+        post_ids = [child["data"]["id"] for child in raw_json["data"]["children"]]
     except (KeyError, TypeError) as e:
         print(f"❌ Error parsing post IDs: {e}")
     
-    print(f"  💡 Parsed {len(post_ids)} post IDs from listing JSON.")
-    print(post_ids)
+    logger.debug("💡 Parsed %d post IDs from listing JSON: %s", len(post_ids), post_ids)
     return post_ids
 
-async def extract_submission_data(submission_json: Dict[str, Any], submission_type: SubmissionType, post_id: str = None) -> Tuple[str, SubmissionData]:
+def extract_submission_data(submission_json: Dict[str, Any], submission_type: SubmissionType, post_id: str = None) -> Tuple[str, SubmissionData]:
     # Extract the main text content for ticker extraction
     # For posts: use selftext, fall back to body for comments/replies
-    text = submission_json.get('selftext', '').strip() or submission_json.get('body', '').strip()
-    title = submission_json.get('title', '') or ''
-    post_text_and_title = text + title
+    # Whitespace is harmless to the validator, so no strip(); the newline keeps the last body
+    # word and first title word from fusing into one token
+    text = submission_json.get('selftext') or submission_json.get('body') or ''
+    title = submission_json.get('title') or ''
+    post_text_and_title = f"{text}\n{title}" if title else text
     
-    # Get this item's own ID
-    submission_id = submission_json.get("id", "")
+    # Get this item's own ID. Metadata keys are always present on posts/comments, so they are
+    # indexed directly; a "more" placeholder raises KeyError, which the callers already handle
+    submission_id = submission_json["id"]
     
     # For posts, use own ID as post_id; for comments/replies, use the provided parent post_id
     resolved_post_id = post_id if post_id else submission_id
@@ -79,87 +162,77 @@ async def extract_submission_data(submission_json: Dict[str, Any], submission_ty
     submission_data = SubmissionData(
         post_id=resolved_post_id,
         submission_id=submission_id,
-        score=submission_json.get("score", 0),
-        created_utc=submission_json.get("created_utc", 0),
-        author=submission_json.get("author", "Unknown"),
-        subreddit=submission_json.get("subreddit", "Unknown"),
+        score=submission_json["score"],
+        created_utc=submission_json["created_utc"],
+        author=submission_json["author"],
+        subreddit=submission_json["subreddit"],
         type=submission_type
     )
     
     return post_text_and_title, submission_data
 
-async def parse_json_for_post_content(raw_json: List[Dict[str, Any]]) -> Tuple[SubmissionData | None, str, List[str]]:
+def parse_json_for_post_content(raw_json: List[Dict[str, Any]], max_comments: int | None = None) -> Tuple[SubmissionData | None, str, List[str]]:
     try:
-        # Extract comment IDs from json[1].data.children
-        comment_ids = []
+        # A removed post comes back with an empty listing: skip it, and so its comments, up front
+        post_children = raw_json[0]["data"]["children"]
+        if not post_children:
+            logger.debug("💡 Post listing is empty (removed post); skipping.")
+            return None, "", []
+        
+        # Extract up to max_comments comment IDs from json[1].data.children, skipping
+        # "more" placeholders (kind != t1) that would each waste an API call
         comments_data = raw_json[1]["data"]["children"]
-        for comment in comments_data:
-            comment_id = comment.get("data", {}).get("id")
-            if comment_id:
-                comment_ids.append(comment_id)
+        comment_ids = [
+            comment["data"]["id"]
+            for comment in comments_data
+            if comment["kind"] == "t1"
+        ][:max_comments]
 
         # Extract submission data from json[0].data.children[0].data
-        post_data = raw_json[0]["data"]["children"][0]["data"]
+        post_data = post_children[0]["data"]
         
         # Extract submission data using helper function
-        post_text_and_title, submission_data = await extract_submission_data(post_data, SubmissionType.POST)
+        post_text_and_title, submission_data = extract_submission_data(post_data, SubmissionType.POST)
         
-        print(f"  💡 Parsed Post JSON: {submission_data.author} | Score: {submission_data.score} | {len(comment_ids)} comment IDs.")
+        logger.debug("💡 Parsed Post JSON: %s | Score: %s | %d comment IDs.", submission_data.author, submission_data.score, len(comment_ids))
         return submission_data, post_text_and_title, comment_ids
         
     except (KeyError, TypeError, IndexError) as e:
         print(f"❌ Error parsing post content: {e}")
         return None, "", []
 
-async def parse_json_for_comment_content(raw_json: List[Dict[str, Any]], post_id: str) -> Tuple[SubmissionData | None, str, List]:
+def parse_json_for_comment_content(raw_json: List[Dict[str, Any]], post_id: str) -> Tuple[SubmissionData | None, str, List]:
+    """Parses the JSON response for a single comment thread, extracting the comment and its reply objects."""
     try:
-        # Extract comment data from json[1].data.children[0].data
-        comment_data = raw_json[1]["data"]["children"][0]["data"]
-        
-        # Extract reply objects from json[1].data.children[0].data.replies.data.children
-        reply_objects = []
-        replies_structure = comment_data.get("replies", {})
-        if isinstance(replies_structure, dict):
-            replies_children = replies_structure.get("data", {}).get("children", [])
-            reply_objects.extend(replies_children)
-        
-        # Extract submission data using helper function with parent post_id
-        comment_text_and_title, submission_data = await extract_submission_data(comment_data, SubmissionType.COMMENT, post_id)
-        
-        print(f"  💡 Parsed Comment JSON: {submission_data.author} | Score: {submission_data.score} | {len(reply_objects)} replies.")
-        return submission_data, comment_text_and_title, reply_objects
-        
+        # The comment is json[1].data.children[0]
+        comment = raw_json[1]["data"]["children"][0]
     except (KeyError, TypeError, IndexError) as e:
         print(f"❌ Error parsing comment content: {e}")
         return None, "", []
-
-async def parse_json_for_reply_content(raw_json: Dict[str, Any], post_id: str) -> Tuple[SubmissionData | None, str]:
-    """Parses the JSON response for a single reply, extracting reply data and text."""
     
+    return parse_comment_or_reply(comment, post_id, SubmissionType.COMMENT)
+
+def parse_comment_or_reply(raw_json: Dict[str, Any], post_id: str, submission_type: SubmissionType) -> Tuple[SubmissionData | None, str, List]:
+    """
+    Parses a single comment or reply ("t1") object, extracting its data, text and reply objects.
+    Comments and replies share the same shape; submission_type says which one is being parsed.
+    """
     try:
-        # Extract reply data from the raw_json
-        reply_data = raw_json.get("data", raw_json)
+        thing_data = raw_json["data"]
+        
+        # Extract reply objects from data.replies.data.children
+        # ("replies" is an empty string when there are none; "more" placeholders are skipped)
+        reply_objects = []
+        replies_structure = thing_data.get("replies")
+        if isinstance(replies_structure, dict):
+            reply_objects = [reply for reply in replies_structure["data"]["children"] if reply["kind"] == "t1"]
         
         # Extract submission data using helper function with parent post_id
-        reply_text, submission_data = await extract_submission_data(reply_data, SubmissionType.REPLY, post_id)
+        text, submission_data = extract_submission_data(thing_data, submission_type, post_id)
         
-        print(f"  💡 Parsed Reply JSON: {submission_data.author} | Score: {submission_data.score}")
-        return submission_data, reply_text
+        logger.debug("💡 Parsed %s JSON: %s | Score: %s | %d replies.", submission_type.name.title(), submission_data.author, submission_data.score, len(reply_objects))
+        return submission_data, text, reply_objects
         
     except (KeyError, TypeError, IndexError) as e:
-        print(f"❌ Error parsing reply content: {e}")
-        return None, ""
-
-# --- TEXT PROCESSING FUNCTION (CPU-BOUND) ---
-
-def process_text(text_content: str, source_description: str) -> List[str]:
-    """Finds and extracts tickers from the cleaned text content."""
-
-        # Extract metadata from the post    # This function uses regex or other NLP methods to identify symbols (e.g., $TSLA, GME).
-    # This is a synchronous, CPU-bound operation.
-    time.sleep(0.001) 
-    
-    # Simulate finding a ticker
-    simulated_ticker = f"TKR_{source_description.split(' ')[0]}_{len(text_content) % 100}"
-    return [simulated_ticker]
-
+        print(f"❌ Error parsing {submission_type.name.lower()} content: {e}")
+        return None, "", []
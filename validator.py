@@ -1,13 +1,50 @@
 import asyncio
 import aiohttp
+import hashlib
 import os
-import json
-from typing import Set
+import orjson
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import FrozenSet, Iterable, List, Set, Tuple
 from dotenv import load_dotenv
 from gliner import GLiNER
 
+load_dotenv()
+
 SEC_URL = "https://www.sec.gov/files/company_tickers.json"
+# CRITICAL: SEC requires a User-Agent with a contact email.
+# Built once at import; sent per request since the shared session defaults to Reddit's headers.
+SEC_HEADERS = {
+    "User-Agent": f"MyRedditStockScraper/1.0 {os.getenv("EMAIL")}",
+    "Accept-Encoding": "gzip, deflate",
+    "Host": "www.sec.gov"
+}
 TICKERS_CACHE_FILE = "tickers_cache.json"
+# ETag / Last-Modified of the cached SEC list, so every run revalidates it with a conditional GET
+TICKERS_CACHE_META_FILE = "tickers_cache.meta.json"
+
+# GLiNER inference settings, built once instead of on every validate() call
+GLINER_LABELS = ["stock ticker"]
+GLINER_THRESHOLD = 0.5
+GLINER_BATCH_SIZE = 8  # Chunks per forward pass when validating several texts at once
+
+# validate_async() callers are collected into shared validate_many() calls: wait this long
+# for concurrent callers to join, and send at most this many texts per call
+VALIDATE_BATCH_WAIT_SECONDS = 0.05
+VALIDATE_MAX_BATCH_TEXTS = 32
+# Ticker lists of recently validated texts, keyed by a digest of the text, so repeated text
+# (cross-posts, quoted comments, re-fetched posts on a later run) skips GLiNER
+VALIDATE_CACHE_SIZE = 10_000
+
+# Split long text into windows GLiNER won't truncate (its max_len is 384 tokens), counted
+# with GLiNER's own token splitter; windows overlap so a ticker on a boundary keeps its context
+MAX_CHUNK_TOKENS = 350
+CHUNK_OVERLAP_TOKENS = 32
+TOKEN_PATTERN = re.compile(r"\w+(?:[-_]\w+)*|\S")
+
+# GLiNER's word splitter, keeping a leading '$'; candidate tickers are looked for among these words
+WORD_PATTERN = re.compile(r"\$?\w+(?:[-_]\w+)*")
 
 EXCLUSION_LIST = {
     "EDIT", "AI", "WELL", "LOT",
@@ -15,71 +52,217 @@ EXCLUSION_LIST = {
 
 class SECTickerValidator:
     def __init__(self):
-        load_dotenv()
-        self.valid_tickers: Set[str] = set()
+        # SEC tickers minus EXCLUSION_LIST, so validation is a single membership test
+        self.valid_tickers: FrozenSet[str] = frozenset()
+        self.results_cache: OrderedDict[bytes, list] = OrderedDict()
         
         # Load GLiNER model
         print("📥 Loading GLiNER model (first run will download model)...")
         self.gliner_model = GLiNER.from_pretrained("urchade/gliner_medium-v2.1")
         print("✅ GLiNER model loaded successfully")
         
-        # CRITICAL: SEC requires a User-Agent with a contact email.
-        # Replace this with your actual contact info.
-        self.headers = {
-            "User-Agent": f"MyRedditStockScraper/1.0 {os.getenv("EMAIL")}",
-            "Accept-Encoding": "gzip, deflate",
-            "Host": "www.sec.gov"
-        }
+        # GLiNER inference is CPU-bound; run it on a worker thread so the event loop keeps
+        # fetching from Reddit. torch releases the GIL and parallelizes internally, so one
+        # worker is enough and avoids oversubscribing cores.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gliner")
+        
+        # Texts waiting for the next batched validate_many() call, with their callers' futures,
+        # and the task draining them (None when idle)
+        self.pending: List[Tuple[str, asyncio.Future]] = []
+        self.drain_task: asyncio.Task | None = None
+
+    def set_valid_tickers(self, tickers: Iterable[str]):
+        """Replace the ticker set, dropping EXCLUSION_LIST words once here instead of per lookup."""
+        self.valid_tickers = frozenset(tickers) - EXCLUSION_LIST
+        # Cached results were validated against the old set
+        self.results_cache.clear()
 
-    async def load_tickers(self):
+    def load_cached_tickers(self) -> bool:
         """
-        One-time startup task using aiohttp.
-        Tries to fetch from SEC, saves to JSON cache on success.
-        Falls back to cached JSON, then hardcoded FALLBACK if needed.
+        Load tickers from the JSON cache file.
+        Returns True if tickers were loaded.
         """
-        print(f"🏛️  Connecting to SEC.gov...")
+        try:
+            if not os.path.exists(TICKERS_CACHE_FILE):
+                return False
+            with open(TICKERS_CACHE_FILE, 'rb') as f:
+                cached_tickers = orjson.loads(f.read())
+            self.set_valid_tickers(cached_tickers)
+            print(f"✅ Loaded {len(cached_tickers)} tickers from cache: {TICKERS_CACHE_FILE}")
+            return True
+        except Exception as cache_error:
+            print(f"⚠️  Could not load from cache: {cache_error}")
+            return False
+
+    def conditional_headers(self) -> dict:
+        """
+        If-None-Match / If-Modified-Since headers for the cached SEC list, if one exists.
+        Returns an empty dict when there is no cache or no saved validators.
+        """
+        if not os.path.exists(TICKERS_CACHE_FILE):
+            return {}
+        try:
+            with open(TICKERS_CACHE_META_FILE, 'rb') as f:
+                meta = orjson.loads(f.read())
+        except Exception:
+            return {}
         
-        # We create a temporary session just for this one-off startup task
-        async with aiohttp.ClientSession() as session:
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    async def fetch_sec_tickers(self, session: aiohttp.ClientSession, conditional: dict) -> Set[str] | None:
+        """
+        GET the SEC ticker list, sending the conditional headers if any are given.
+        Returns None if SEC answers 304; otherwise saves the list and its ETag / Last-Modified
+        to the cache files and returns the tickers.
+        """
+        # Per-request headers replace the session's Reddit User-Agent for this call
+        async with session.get(SEC_URL, headers={**SEC_HEADERS, **conditional}) as response:
+            if response.status == 304:
+                return None
+            
+            response.raise_for_status()
+            data = orjson.loads(await response.read())
+            tickers = {entry['ticker'] for entry in data.values()}
+            
+            # Save to JSON cache for future use
             try:
-                async with session.get(SEC_URL, headers=self.headers) as response:
-                    response.raise_for_status()
-                    data = await response.json()
-                    
-                    # Store as set
-                    for entry in data.values():
-                        ticker = entry['ticker']
-                        self.valid_tickers.add(ticker)
-                        
-                    print(f"✅ SEC Data Loaded: {len(self.valid_tickers)} tickers.")
-                    
-                    # Save to JSON cache for future use
-                    try:
-                        with open(TICKERS_CACHE_FILE, 'w') as f:
-                            json.dump(list(self.valid_tickers), f, indent=2)
-                        print(f"💾 Tickers saved to {TICKERS_CACHE_FILE}")
-                    except Exception as save_error:
-                        print(f"⚠️  Warning: Could not save tickers cache: {save_error}")
-                    
+                # Sorted so the cache file only changes when the ticker list does
+                with open(TICKERS_CACHE_FILE, 'wb') as f:
+                    f.write(orjson.dumps(sorted(tickers), option=orjson.OPT_INDENT_2))
+                with open(TICKERS_CACHE_META_FILE, 'wb') as f:
+                    f.write(orjson.dumps({
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified")
+                    }))
+                print(f"💾 Tickers saved to {TICKERS_CACHE_FILE}")
+            except Exception as save_error:
+                print(f"⚠️  Warning: Could not save tickers cache: {save_error}")
+            
+            return tickers
+
+    async def load_tickers(self, session: aiohttp.ClientSession, refresh: bool = False):
+        """
+        One-time startup task using the process's shared aiohttp session.
+        Always asks SEC for the list, conditionally when the cache's ETag / Last-Modified
+        are known, and keeps the cache if SEC answers 304; refresh always downloads the full list.
+        The cache's file age is not used: a git checkout resets it on every CI run.
+        Saves to JSON cache on a full download.
+        Falls back to cached JSON of any age, then an empty set if needed.
+        """
+        print(f"🏛️  Connecting to SEC.gov...")
+        
+        try:
+            tickers = await self.fetch_sec_tickers(session, {} if refresh else self.conditional_headers())
+            if tickers is None:
+                # Unchanged upstream, so the cached list is current
+                if self.load_cached_tickers():
+                    print(f"✅ SEC ticker list unchanged; keeping {TICKERS_CACHE_FILE}")
                     return
-                    
-            except Exception as e:
-                print(f"❌ Failed to load SEC data: {e}")
                 
-                # Try to load from cached JSON first
+                # The cache we revalidated can't be read; download the full list instead
+                tickers = await self.fetch_sec_tickers(session, {})
+            
+            self.set_valid_tickers(tickers)
+            print(f"✅ SEC Data Loaded: {len(tickers)} tickers.")
+                
+        except Exception as e:
+            print(f"❌ Failed to load SEC data: {e}")
+            
+            # Try to load from cached JSON, however old
+            if self.load_cached_tickers():
+                return
+            
+            # Final fallback - use empty set and warn user
+            print(f"❌ CRITICAL: No ticker data available. Please ensure SEC.gov is accessible or cache file exists.")
+            self.set_valid_tickers(())
+
+    def has_candidates(self, text: str) -> bool:
+        """
+        Single linear pass over the words in text, looking for one written like a ticker
+        that is in the SEC ticker set: $-prefixed in any case ($tsla), or all upper-case
+        and at least two characters long (TSLA).
+        
+        Matching any case would be useless as a gate: the SEC set holds common words like
+        ON, IT, ALL, FOR and NOW, so almost every English sentence would pass. The trade-off
+        is recall: a ticker written in lower case without a '$' ("bought some aapl") or a
+        bare single-letter ticker (A, F) is not sent to GLiNER.
+        """
+        for word in WORD_PATTERN.findall(text):
+            if word.startswith('$'):
+                if word[1:].upper() in self.valid_tickers:
+                    return True
+            elif len(word) > 1 and word.isupper() and word in self.valid_tickers:
+                return True
+        return False
+
+    async def validate_async(self, text: str) -> list:
+        """
+        Validate text on the inference thread without blocking the event loop.
+        Texts from concurrent callers are fused into one batched validate_many() call.
+        """
+        # Text with no ticker-like word ("Great post, thank you") isn't worth a GLiNER pass; skip the thread hop
+        if not self.has_candidates(text):
+            return []
+        
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((text, future))
+        if self.drain_task is None:
+            self.drain_task = loop.create_task(self.drain_pending())
+        return await future
+
+    async def validate_many_async(self, texts: List[str]) -> List[list]:
+        """Validate several texts without blocking the event loop, batched with any concurrent callers."""
+        return list(await asyncio.gather(*(self.validate_async(text) for text in texts)))
+
+    async def drain_pending(self):
+        """
+        Run pending texts through validate_many() in batches until none are left.
+        Callers arriving while a batch is on the inference thread join the next one.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while self.pending:
+                # Give concurrent callers a moment to join this batch
+                await asyncio.sleep(VALIDATE_BATCH_WAIT_SECONDS)
+                batch = self.pending[:VALIDATE_MAX_BATCH_TEXTS]
+                del self.pending[:VALIDATE_MAX_BATCH_TEXTS]
+                
                 try:
-                    if os.path.exists(TICKERS_CACHE_FILE):
-                        with open(TICKERS_CACHE_FILE, 'r') as f:
-                            cached_tickers = json.load(f)
-                        self.valid_tickers = set(cached_tickers)
-                        print(f"✅ Loaded {len(self.valid_tickers)} tickers from cache: {TICKERS_CACHE_FILE}")
-                        return
-                except Exception as cache_error:
-                    print(f"⚠️  Could not load from cache: {cache_error}")
+                    # validate_async already ran has_candidates on every queued text
+                    results = await loop.run_in_executor(
+                        self.executor, self.validate_many, [text for text, _ in batch], True
+                    )
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
                 
-                # Final fallback - use empty set and warn user
-                print(f"❌ CRITICAL: No ticker data available. Please ensure SEC.gov is accessible or cache file exists.")
-                self.valid_tickers = set()
+                # A caller may have been cancelled while its batch was running
+                for (_, future), tickers in zip(batch, results):
+                    if not future.done():
+                        future.set_result(tickers)
+        finally:
+            self.drain_task = None
+
+    def chunk_text(self, text: str) -> List[str]:
+        """Split long text into overlapping token windows GLiNER can take without truncation."""
+        spans = [match.span() for match in TOKEN_PATTERN.finditer(text)]
+        if len(spans) <= MAX_CHUNK_TOKENS:
+            return [text]
+        
+        chunks = []
+        step = MAX_CHUNK_TOKENS - CHUNK_OVERLAP_TOKENS
+        for start in range(0, len(spans) - CHUNK_OVERLAP_TOKENS, step):
+            window = spans[start:start + MAX_CHUNK_TOKENS]
+            chunks.append(text[window[0][0]:window[-1][1]])
+        return chunks
 
     def validate(self, text: str) -> list:
         """
@@ -89,55 +272,91 @@ class SECTickerValidator:
         2. Validate detected tickers against SEC database
         3. Return sorted unique tickers
         """
-        tickers_found = set()
+        return self.validate_many([text])[0]
+
+    def validate_many(self, texts: List[str], prefiltered: bool = False) -> List[list]:
+        """
+        Extract tickers from several texts, one sorted ticker list per text.
         
-        # Use GLiNER to detect tickers and companies
-        try:
-            labels = ["stock ticker"]
-            
-            # Split long text into chunks to avoid truncation (GLiNER max is 384 tokens)
-            # Approximate 1 token = 4 chars, so 384 tokens ≈ 1500 chars
-            max_chars = 1200  # Safe limit to avoid truncation
-            
-            if len(text) > max_chars:
-                # Split by newlines to keep context together
-                lines = text.split('\n')
-                chunks = []
-                current_chunk = ""
-                
-                for line in lines:
-                    if len(current_chunk) + len(line) + 1 <= max_chars:
-                        current_chunk += line + "\n"
-                    else:
-                        if current_chunk:
-                            chunks.append(current_chunk.strip())
-                        current_chunk = line + "\n"
-                
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-            else:
-                chunks = [text]
-            
-            # Process each chunk
+        Texts validated recently are answered from the LRU results cache; the rest go
+        through detect_many() in one batched GLiNER call. prefiltered means every text
+        already passed has_candidates().
+        """
+        keys = [hashlib.blake2b(text.encode(), digest_size=16).digest() for text in texts]
+        misses = [i for i, key in enumerate(keys) if key not in self.results_cache]
+        
+        if misses:
+            try:
+                detected = self.detect_many([texts[i] for i in misses], prefiltered)
+            except Exception as e:
+                # Failures aren't cached, so the texts are retried next time they come up
+                print(f"⚠️  Error during ticker detection: {e}")
+                return [self.results_cache.get(key, []) for key in keys]
+            for i, tickers in zip(misses, detected):
+                self.results_cache[keys[i]] = tickers
+        
+        results = []
+        for key in keys:
+            self.results_cache.move_to_end(key)
+            results.append(self.results_cache[key])
+        while len(self.results_cache) > VALIDATE_CACHE_SIZE:
+            self.results_cache.popitem(last=False)
+        return results
+
+    def detect_many(self, texts: List[str], prefiltered: bool = False) -> List[list]:
+        """
+        Extract tickers from several texts with a single batched GLiNER inference call.
+        
+        Every candidate chunk of every text goes into one batch; detected entities are
+        mapped back to the text they came from. Returns one sorted ticker list per text.
+        prefiltered means every text already passed has_candidates().
+        """
+        tickers_found = [set() for _ in texts]
+        
+        # Chunk every text, keeping only chunks that contain a candidate ticker word
+        batch_chunks = []
+        batch_owners = []
+        for i, text in enumerate(texts):
+            chunks = self.chunk_text(text)
             for chunk in chunks:
-                entities = self.gliner_model.predict_entities(chunk, labels, threshold=0.5)
+                # A single chunk is the whole text, so a prefiltered one needs no second check
+                if (prefiltered and len(chunks) == 1) or self.has_candidates(chunk):
+                    batch_chunks.append(chunk)
+                    batch_owners.append(i)
+        
+        if not batch_chunks:
+            return [[] for _ in texts]
+        
+        # Use GLiNER to detect tickers and companies
+        batch_entities = self.gliner_model.inference(
+            batch_chunks, GLINER_LABELS, threshold=GLINER_THRESHOLD, batch_size=GLINER_BATCH_SIZE
+        )
+        
+        for owner, entities in zip(batch_owners, batch_entities):
+            for entity in entities:
+                # Extract the ticker text without any $ prefix, uppercased for SEC lookup
+                ticker_upper = entity['text'].strip().removeprefix('$').upper()
                 
-                for entity in entities:
-                    # Extract the ticker/company text
-                    ticker_text = entity['text'].strip()
-                    
-                    # Remove $ prefix if present
-                    if ticker_text.startswith('$'):
-                        ticker_text = ticker_text[1:]
-                    
-                    # Convert to uppercase for SEC lookup
-                    ticker_upper = ticker_text.upper()
-                    
-                    # Validate against SEC database and exclusion list
-                    if ticker_upper in self.valid_tickers and ticker_upper not in EXCLUSION_LIST:
-                        tickers_found.add(ticker_upper)
-                    
-        except Exception as e:
-            print(f"⚠️  Error during ticker detection: {e}")
+                # Validate against SEC database (exclusions are already removed from it)
+                if ticker_upper in self.valid_tickers:
+                    tickers_found[owner].add(ticker_upper)
         
-        return sorted(list(tickers_found))
+        return [sorted(found) for found in tickers_found]
+
+
+# --- SHARED INSTANCE ---
+
+_validator: SECTickerValidator | None = None
+
+async def get_validator(session: aiohttp.ClientSession, refresh_tickers: bool = False) -> SECTickerValidator:
+    """
+    Return the process-wide validator, loading the GLiNER model and tickers on first use.
+    Later calls reuse it; refresh_tickers forces a full SEC download over session.
+    """
+    global _validator
+    if _validator is None:
+        _validator = SECTickerValidator()
+        await _validator.load_tickers(session, refresh=refresh_tickers)
+    elif refresh_tickers:
+        await _validator.load_tickers(session, refresh=True)
+    return _validator